@@ -1,15 +1,12 @@
-import os
-import json
-import gzip
-import requests
-import numpy as np
-import pandas as pd
-import geopandas as gpd
+from functools import partial
+
 import streamlit as st
-import folium
-from shapely.geometry import Point, mapping
 from streamlit_folium import st_folium
-from datetime import datetime
+from survey_core import (
+    cell_text, get_geojson_data, get_http_session, get_tree, load_data, make_map,
+    nearest_index, show_submit_outcomes, start_submit_retry, submit_form,
+    submit_in_background,
+)
 
 # (Optional) get user geolocation; if missing, we fall back to blanks
 try:
@@ -40,8 +37,9 @@ st.markdown("""
 - (Optional) **Add a short note** (e.g., “road works”, “rush hour”).  
 - **Submit** your answer.
 
-**Important:** Loading the map can take a bit. Hang tight for a few seconds. .After each **click** or **submit**, the page may take **5–6 seconds** to process.  
-Please **stay on this page** until you see the confirmation message.
+**Important:** Loading the map can take a bit the first time.  
+Your answer is sent in the background, so you can rate the next street right after you **submit**.  
+If an answer can’t be sent, a note appears in the sidebar.
 
 **Privacy:** We only store your answer and the clicked map location — no name or email.
 """)
@@ -65,9 +63,9 @@ ENTRY_MAP = {
     "user_lon":    "entry.1041474888",
 }
 
-def send_to_google_form(payload: dict, timeout: int = 20):
-    """POST to Google Form. 200 or 302 considered success."""
-    data = {
+def form_data(payload: dict) -> dict:
+    """Google Form fields (entry id -> str) for a response; this is all that is posted."""
+    return {
         ENTRY_MAP["osmid"]:       str(payload.get("osmid","")),
         ENTRY_MAP["highway"]:     str(payload.get("highway","")),
         ENTRY_MAP["pred_label"]:  str(payload.get("pred_label","")),
@@ -80,146 +78,28 @@ def send_to_google_form(payload: dict, timeout: int = 20):
         ENTRY_MAP["user_lat"]:    str(payload.get("user_lat","")),
         ENTRY_MAP["user_lon"]:    str(payload.get("user_lon","")),
     }
-    r = requests.post(FORM_URL, data=data, timeout=timeout)
-    return r.status_code in (200, 302), r.status_code, r.text[:200]
-
-# =========================
-# Data loader (.geojson / .geojson.gz)
-# =========================
-@st.cache_data
-def load_data(path: str) -> gpd.GeoDataFrame:
-    if not os.path.exists(path):
-        try:
-            listing = os.listdir("data")
-        except Exception:
-            listing = []
-        st.error(
-            f"Data file not found: {path}\n\n"
-            f"Available in ./data: {listing}\n"
-            f"Tip: If you committed roads_wgs.geojson.gz, call load_data('data/roads_wgs.geojson.gz')."
-        )
-        st.stop()
-
-    # LFS pointer check
-    try:
-        with open(path, "rb") as f:
-            head = f.read(64)
-        if head.startswith(b"version https://git-lfs.github.com/spec"):
-            st.error(
-                "⚠️ The file seems to be a Git LFS pointer, not the actual GeoJSON.\n\n"
-                "Fix: commit a simplified gzipped file under 25MB (roads_wgs.geojson.gz)."
-            )
-            st.stop()
-    except Exception:
-        pass
-
-    try:
-        if path.endswith(".geojson.gz"):
-            with gzip.open(path, "rt", encoding="utf-8") as f:
-                data = json.load(f)
-            gdf = gpd.GeoDataFrame.from_features(data["features"])
-            if gdf.crs is None:
-                gdf.set_crs(4326, inplace=True)
-            else:
-                gdf = gdf.to_crs(4326)
-        else:
-            gdf = gpd.read_file(path).to_crs(4326)
-    except Exception as e:
-        st.error(f"❌ Failed to read geo data: {path}\n\n{e}")
-        st.stop()
 
-    gdf["disturbance"] = pd.to_numeric(gdf.get("disturbance"), errors="coerce")
-    if "disturbance_label" not in gdf.columns:
-        bins = [0, 0.33, 0.66, 1]
-        gdf["disturbance_label"] = pd.cut(
-            gdf["disturbance"], bins=bins,
-            labels=["Low", "Medium", "High"],
-            include_lowest=True
-        )
-    return gdf
+# POSTed through the shared session; see survey_core.submit_form
+send_to_google_form = partial(submit_form, FORM_URL)
 
-DF_PATH = "data/roads_wgs.geojson.gz"
-df = load_data(DF_PATH)
+# Responses whose POST failed wait here until the retry thread gets them through
+FAILED_SUBMITS_LOG = "feedback/failed_submits_app_survey.jsonl"
+start_submit_retry(FAILED_SUBMITS_LOG, partial(send_to_google_form, timeout=20, session=get_http_session()))
 
 # =========================
-# Geometry cleaning
-# =========================
-df = df[df.geometry.notna()].copy()
-if hasattr(df.geometry, "is_empty"):
-    df = df[~df.geometry.is_empty].copy()
-df = df[df.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
-df = df.explode(index_parts=False, ignore_index=True)
-df["disturbance"] = pd.to_numeric(df["disturbance"], errors="coerce").fillna(0.0).clip(0, 1)
-if "disturbance_label" not in df.columns:
-    bins = [0, 0.33, 0.66, 1]
-    df["disturbance_label"] = pd.cut(df["disturbance"], bins=bins,
-                                     labels=["Low", "Medium", "High"], include_lowest=True)
-if len(df) == 0:
-    st.error("No line features to display after cleaning. Check your input data.")
-    st.stop()
-
+# Load data (cached)
 # =========================
-# Manual GeoJSON for Folium
-# =========================
-def to_py(obj):
-    if isinstance(obj, np.generic):
-        obj = obj.item()
-    if isinstance(obj, (pd.Timestamp, datetime)):
-        return obj.isoformat()
-    try:
-        if pd.isna(obj):
-            return None
-    except Exception:
-        pass
-    if hasattr(obj, "tolist") and not isinstance(obj, (str, bytes)):
-        try:
-            return obj.tolist()
-        except Exception:
-            pass
-    return obj
-
-def build_geojson(gdf: gpd.GeoDataFrame) -> dict:
-    props_cols = [c for c in gdf.columns if c != gdf.geometry.name]
-    features = []
-    for _, row in gdf.iterrows():
-        geom = row.geometry
-        if geom is None:
-            continue
-        features.append({
-            "type": "Feature",
-            "geometry": mapping(geom),
-            "properties": {col: to_py(row[col]) for col in props_cols}
-        })
-    return {"type": "FeatureCollection", "features": features}
-
-geojson_data = build_geojson(df)
+DF_PATH = "data/roads_wgs.geojson.gz"
+df = load_data(DF_PATH)
+geojson_data = get_geojson_data(DF_PATH)
+get_tree(DF_PATH, df)  # build the index with the data, not on the first click
 
 # =========================
 # Map (no legend, no tooltip)
 # =========================
-center = [
-    df.geometry.representative_point().y.mean(),
-    df.geometry.representative_point().x.mean()
-]
-m = folium.Map(location=center, zoom_start=13, tiles="cartodbpositron")
+m = make_map(DF_PATH, geojson_data, df.total_bounds)
 
-from branca.colormap import LinearColormap
-cmap = LinearColormap(['green', 'yellow', 'orange', 'red'], vmin=0, vmax=1)
-# No legend: do not add cmap to the map
-
-folium.GeoJson(
-    geojson_data,
-    style_function=lambda f: {
-        "color": cmap(float(f["properties"].get("disturbance", 0))),
-        "weight": 3 if float(f["properties"].get("disturbance", 0)) < 0.7 else 4,
-        "opacity": 0.9 if float(f["properties"].get("disturbance", 0)) >= 0.33 else 0.6
-    },
-    highlight_function=lambda f: {"weight": 6},
-    # No tooltip to avoid technical fields
-    name="Roads"
-).add_to(m)
-
-st.caption("Click a street line, then use the sidebar to submit your feedback. (Processing may take 5–6 seconds.)")
+st.caption("Click a street line, then use the sidebar to submit your feedback. (Processing may take a few seconds.)")
 out = st_folium(m, height=600, use_container_width=True, returned_objects=["last_object_clicked"])
 
 # =========================
@@ -230,9 +110,7 @@ lat = lon = None
 if out and out.get("last_object_clicked"):
     lat = float(out["last_object_clicked"]["lat"])
     lon = float(out["last_object_clicked"]["lng"])
-    clicked_pt = gpd.GeoSeries([Point(lon, lat)], crs=4326).to_crs(df.crs)
-    idx = df.distance(clicked_pt.iloc[0]).sort_values().index[0]
-    selected = df.loc[idx]
+    selected = df.iloc[nearest_index(DF_PATH, df, lon, lat)]
 
 user_lat = user_lon = ""
 if HAS_JS_GEO:
@@ -245,48 +123,62 @@ if HAS_JS_GEO:
         pass
 
 # =========================
-# Sidebar Form (agreement slider + optional comment)
+# Sidebar Form (agreement slider + optional comment), as a fragment
 # =========================
-st.sidebar.header("Rate this street")
+@st.fragment
+def rate_street(selected, lat, lon, user_lat, user_lon):
+    """Rating form for the clicked street; a submit reruns only this
+    fragment, not the map above."""
+    # Outcome of earlier submits, which run in the background
+    show_submit_outcomes()
 
-if selected is None:
-    st.sidebar.info("Click a street on the map to start.")
-else:
-    pred_label = str(selected.get('disturbance_label', ''))
-    pred_score = float(selected.get('disturbance', 0.0))
-    highway = str(selected.get('highway', ''))
+    if selected is None:
+        st.info("Click a street on the map to start.")
+        return
 
-    rating = st.sidebar.slider(
-        "How much do you agree with this street’s noise prediction? "
-        "(1 = don’t agree at all, 5 = completely agree)",
-        1, 5, 3, key="rating_agree"
+    pred_label = cell_text(selected.get('disturbance_label'))
+    pred_score = float(selected.get('disturbance', 0.0))
+    highway = cell_text(selected.get('highway'))
+
+    # One form: moving the slider or typing a comment doesn't rerun the
+    # whole page (map included); values arrive together on submit
+    with st.form("rate_street", clear_on_submit=True):
+        rating = st.slider(
+            "How much do you agree with this street’s noise prediction? "
+            "(1 = don’t agree at all, 5 = completely agree)",
+            1, 5, 3, key="rating_agree"
         )
-    # Conditional helper note when rating indicates disagreement
-    if rating <= 2:
-        st.sidebar.warning(
-            "You seem to disagree. Please tell us why, and which color you think "
+        # Inside a form the note can't react to the slider, so it's always shown
+        st.caption(
+            "If you disagree (1–2), please tell us why, and which color you think "
             "this street should be (green / yellow / red)."
         )
 
-    comment = st.sidebar.text_input("Optional comment (e.g., road works, rush hour)", key="comment")
+        comment = st.text_input("Optional comment (e.g., road works, rush hour)", key="comment")
 
-    if st.sidebar.button("Submit", use_container_width=True):
+        submit = st.form_submit_button("Submit", use_container_width=True)
+
+    if submit:
         payload = {
-            "osmid": str(selected.get("osmid", "")),
+            "osmid": cell_text(selected.get("osmid")),
             "highway": highway,
             "pred_label": pred_label,   # saved in background
             "pred_score": pred_score,   # saved in background
             "agree": "NaN",             # UI removed; send 'NaN' string
             "rating_1to5": int(rating),
             "comment": comment,
-            "click_lat": float(lat) if lat is not None else "",
-            "click_lon": float(lon) if lon is not None else "",
+            "click_lat": lat if lat is not None else "",
+            "click_lon": lon if lon is not None else "",
             "user_lat": user_lat,
             "user_lon": user_lon
         }
-        with st.spinner("Submitting… please wait ~5–6 seconds"):
-            ok, code, preview = send_to_google_form(payload, timeout=20)
-        if ok:
-            st.sidebar.success("✅ Thanks! Your response has been saved.")
-        else:
-            st.sidebar.warning(f"Submission issue (HTTP {code}). Please try again.")
+        # Don't hold the page for the POST; failures show up on the next run
+        submit_in_background(
+            send_to_google_form, form_data(payload), failed_log=FAILED_SUBMITS_LOG,
+            timeout=20, session=get_http_session(),
+        )
+        st.toast("Thanks! Your response is being saved. If it can’t be sent, a note will appear in the sidebar.", icon="✅")
+
+with st.sidebar:
+    st.header("Rate this street")
+    rate_street(selected, lat, lon, user_lat, user_lon)
@@ -1,15 +1,12 @@
-import os
-import json
-import gzip
-import requests
-import numpy as np
-import pandas as pd
-import geopandas as gpd
+from functools import partial
+
 import streamlit as st
-import folium
-from shapely.geometry import Point, mapping
 from streamlit_folium import st_folium
-from datetime import datetime
+from survey_core import (
+    cell_text, get_geojson_data, get_http_session, get_tree, load_data, make_map,
+    nearest_index, show_submit_outcomes, start_submit_retry, submit_form,
+    submit_in_background,
+)
 
 # (Optional) get user geolocation; if missing, we fall back to blanks
 try:
@@ -41,8 +38,8 @@ st.markdown("""
 - **Submit** your answer.
 
 **Important:** Loading the map can take a bit the first time.  
-After each **click** or **submit**, the page may take a few seconds to process.  
-Please **stay on this page** until you see the confirmation message.
+Your answer is sent in the background, so you can rate the next street right after you **submit**.  
+If an answer can’t be sent, a note appears in the sidebar.
 
 **Privacy:** We only store your answer and the clicked map location — no name or email.
 """)
@@ -66,9 +63,9 @@ ENTRY_MAP = {
     "user_lon":    "entry.1041474888",
 }
 
-def send_to_google_form(payload: dict, timeout: int = 20):
-    """POST to Google Form. 200 or 302 considered success."""
-    data = {
+def form_data(payload: dict) -> dict:
+    """Google Form fields (entry id -> str) for a response; this is all that is posted."""
+    return {
         ENTRY_MAP["osmid"]:       str(payload.get("osmid","")),
         ENTRY_MAP["highway"]:     str(payload.get("highway","")),
         ENTRY_MAP["pred_label"]:  str(payload.get("pred_label","")),
@@ -81,137 +78,13 @@ def send_to_google_form(payload: dict, timeout: int = 20):
         ENTRY_MAP["user_lat"]:    str(payload.get("user_lat","")),
         ENTRY_MAP["user_lon"]:    str(payload.get("user_lon","")),
     }
-    r = requests.post(FORM_URL, data=data, timeout=timeout)
-    return r.status_code in (200, 302), r.status_code, r.text[:200]
-
-# =========================
-#  Data loader (.geojson / .geojson.gz)
-#  + geometry cleaning (cached)
-# =========================
-@st.cache_data
-def load_data(path: str) -> gpd.GeoDataFrame:
-    """Load and clean the roads GeoDataFrame (runs once, then cached)."""
-    if not os.path.exists(path):
-        try:
-            listing = os.listdir("data")
-        except Exception:
-            listing = []
-        st.error(
-            f"Data file not found: {path}\n\n"
-            f"Available in ./data: {listing}\n"
-            f"Tip: Put your file under ./data and update DF_PATH."
-        )
-        st.stop()
-
-    # LFS pointer check
-    try:
-        with open(path, "rb") as f:
-            head = f.read(64)
-        if head.startswith(b"version https://git-lfs.github.com/spec"):
-            st.error(
-                "⚠️ The file seems to be a Git LFS pointer, not the actual GeoJSON.\n\n"
-                "Fix: commit a simplified GeoJSON or gzipped GeoJSON under 25MB."
-            )
-            st.stop()
-    except Exception:
-        pass
-
-    # Read file WITHOUT using geopandas.read_file/fiona
-    try:
-        if path.endswith(".geojson.gz"):
-            # gzipped GeoJSON
-            with gzip.open(path, "rt", encoding="utf-8") as f:
-                data = json.load(f)
-        else:
-            # normal .geojson
-            with open(path, "rt", encoding="utf-8") as f:
-                data = json.load(f)
-
-        # Expect FeatureCollection
-        if isinstance(data, dict) and "features" in data:
-            gdf = gpd.GeoDataFrame.from_features(data["features"])
-        else:
-            st.error("❌ File is not a valid GeoJSON FeatureCollection.")
-            st.stop()
-
-        if gdf.crs is None:
-            gdf.set_crs(4326, inplace=True)
-        else:
-            gdf = gdf.to_crs(4326)
-
-    except Exception as e:
-        st.error(f"❌ Failed to read geo data as GeoJSON: {path}\n\n{e}")
-        st.stop()
-
-    # --- Geometry cleaning (once, then cached) ---
-    gdf = gdf[gdf.geometry.notna()].copy()
-    if hasattr(gdf.geometry, "is_empty"):
-        gdf = gdf[~gdf.geometry.is_empty].copy()
-    gdf = gdf[gdf.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
-    gdf = gdf.explode(index_parts=False, ignore_index=True)
-
-    # Disturbance numeric + label
-    gdf["disturbance"] = pd.to_numeric(gdf.get("disturbance"), errors="coerce").fillna(0.0).clip(0, 1)
-    if "disturbance_label" not in gdf.columns:
-        bins = [0, 0.33, 0.66, 1]
-        gdf["disturbance_label"] = pd.cut(
-            gdf["disturbance"], bins=bins,
-            labels=["Low", "Medium", "High"],
-            include_lowest=True
-        )
-
-    if len(gdf) == 0:
-        st.error("No line features to display after cleaning. Check your input data.")
-        st.stop()
-
-    return gdf
 
-# Helper for json conversion
-def to_py(obj):
-    if isinstance(obj, np.generic):
-        obj = obj.item()
-    if isinstance(obj, (pd.Timestamp, datetime)):
-        return obj.isoformat()
-    try:
-        if pd.isna(obj):
-            return None
-    except Exception:
-        pass
-    if hasattr(obj, "tolist") and not isinstance(obj, (str, bytes)):
-        try:
-            return obj.tolist()
-        except Exception:
-            pass
-    return obj
-
-@st.cache_data
-def get_geojson_data(path: str) -> dict:
-    """Build GeoJSON dict for Folium from the cached GeoDataFrame."""
-    gdf = load_data(path)
-    props_cols = [c for c in gdf.columns if c != gdf.geometry.name]
-    features = []
-    for _, row in gdf.iterrows():
-        geom = row.geometry
-        if geom is None:
-            continue
-        features.append({
-            "type": "Feature",
-            "geometry": mapping(geom),
-            "properties": {col: to_py(row[col]) for col in props_cols}
-        })
-    return {"type": "FeatureCollection", "features": features}
-
-# Spatial index (nearest search) - cache as resource
-@st.cache_resource
-def get_sindex(_gdf: gpd.GeoDataFrame):
-    """Create a spatial index for fast nearest-segment queries.
+# POSTed through the shared session; see survey_core.submit_form
+send_to_google_form = partial(submit_form, FORM_URL)
 
-    _gdf is prefixed with underscore so Streamlit doesn't try to hash it.
-    """
-    try:
-        return _gdf.sindex
-    except Exception:
-        return None
+# Responses whose POST failed wait here until the retry thread gets them through
+FAILED_SUBMITS_LOG = "feedback/failed_submits_app_survey_2_mod.jsonl"
+start_submit_retry(FAILED_SUBMITS_LOG, partial(send_to_google_form, timeout=20, session=get_http_session()))
 
 # =========================
 #  Load data (cached)
@@ -221,30 +94,12 @@ DF_PATH = "data/roads_wgs_fribourg_bbox.geojson"
 
 df = load_data(DF_PATH)
 geojson_data = get_geojson_data(DF_PATH)
-sindex = get_sindex(df)
+get_tree(DF_PATH, df)  # build the index with the data, not on the first click
 
 # =========================
 # Map (no legend, no tooltip)
 # =========================
-center = [
-    df.geometry.representative_point().y.mean(),
-    df.geometry.representative_point().x.mean()
-]
-m = folium.Map(location=center, zoom_start=13, tiles="cartodbpositron")
-
-from branca.colormap import LinearColormap
-cmap = LinearColormap(['green', 'yellow', 'orange', 'red'], vmin=0, vmax=1)
-
-folium.GeoJson(
-    geojson_data,
-    style_function=lambda f: {
-        "color": cmap(float(f["properties"].get("disturbance", 0))),
-        "weight": 3 if float(f["properties"].get("disturbance", 0)) < 0.7 else 4,
-        "opacity": 0.9 if float(f["properties"].get("disturbance", 0)) >= 0.33 else 0.6
-    },
-    highlight_function=lambda f: {"weight": 6},
-    name="Roads"
-).add_to(m)
+m = make_map(DF_PATH, geojson_data, df.total_bounds)
 
 st.caption("Click a street line, then use the sidebar to submit your feedback. (Processing may take a few seconds.)")
 out = st_folium(m, height=600, use_container_width=True, returned_objects=["last_object_clicked"])
@@ -258,30 +113,7 @@ lat = lon = None
 if out and out.get("last_object_clicked"):
     lat = float(out["last_object_clicked"]["lat"])
     lon = float(out["last_object_clicked"]["lng"])
-    click_geom = Point(lon, lat)  # df already in 4326
-
-    # Prefer spatial index (fast), fall back to distance if something goes wrong
-    if sindex is not None:
-        try:
-            nearest_idx = sindex.nearest(click_geom, return_all=False)
-
-            # defensive: handle different shapes/backends
-            tree_idx = None
-            if hasattr(nearest_idx, "shape") and nearest_idx.shape[0] == 2:
-                tree_idx = int(nearest_idx[1][0])
-            else:
-                idx_list = list(nearest_idx)
-                tree_idx = int(idx_list[0])
-
-            selected = df.iloc[tree_idx]
-        except Exception:
-            distances = df.distance(click_geom)
-            idx = distances.sort_values().index[0]
-            selected = df.loc[idx]
-    else:
-        distances = df.distance(click_geom)
-        idx = distances.sort_values().index[0]
-        selected = df.loc[idx]
+    selected = df.iloc[nearest_index(DF_PATH, df, lon, lat)]
 
 user_lat = user_lon = ""
 if HAS_JS_GEO:
@@ -294,48 +126,62 @@ if HAS_JS_GEO:
         pass
 
 # =========================
-# Sidebar Form (rating slider + optional comment)
+# Sidebar Form (rating slider + optional comment), as a fragment
 # =========================
-st.sidebar.header("Rate this street")
-
-if selected is None:
-    st.sidebar.info("Click a street on the map to start.")
-else:
-    pred_label = str(selected.get('disturbance_label', ''))
+@st.fragment
+def rate_street(selected, lat, lon, user_lat, user_lon):
+    """Rating form for the clicked street; a submit reruns only this
+    fragment, not the map above."""
+    # Outcome of earlier submits, which run in the background
+    show_submit_outcomes()
+
+    if selected is None:
+        st.info("Click a street on the map to start.")
+        return
+
+    pred_label = cell_text(selected.get('disturbance_label'))
     pred_score = float(selected.get('disturbance', 0.0))
-    highway = str(selected.get('highway', ''))
-
-    rating = st.sidebar.slider(
-        "How much do you agree with this street’s noise prediction? "
-        "(1 = don’t agree at all, 5 = completely agree)",
-        1, 5, 3, key="rating_agree"
-    )
-
-    if rating <= 2:
-        st.sidebar.warning(
-            "You seem to disagree. Please tell us why, and which color you think "
+    highway = cell_text(selected.get('highway'))
+
+    # One form: moving the slider or typing a comment doesn't rerun the
+    # whole page (map included); values arrive together on submit
+    with st.form("rate_street", clear_on_submit=True):
+        rating = st.slider(
+            "How much do you agree with this street’s noise prediction? "
+            "(1 = don’t agree at all, 5 = completely agree)",
+            1, 5, 3, key="rating_agree"
+        )
+        # Inside a form the note can't react to the slider, so it's always shown
+        st.caption(
+            "If you disagree (1–2), please tell us why, and which color you think "
             "this street should be (green / yellow / red)."
         )
 
-    comment = st.sidebar.text_input("Optional comment (e.g., road works, rush hour)", key="comment")
+        comment = st.text_input("Optional comment (e.g., road works, rush hour)", key="comment")
+
+        submit = st.form_submit_button("Submit", use_container_width=True)
 
-    if st.sidebar.button("Submit", use_container_width=True):
+    if submit:
         payload = {
-            "osmid": str(selected.get("osmid", "")),
+            "osmid": cell_text(selected.get("osmid")),
             "highway": highway,
             "pred_label": pred_label,
             "pred_score": pred_score,
             "agree": "NaN",             # UI removed; send 'NaN' string
             "rating_1to5": int(rating),
             "comment": comment,
-            "click_lat": float(lat) if lat is not None else "",
-            "click_lon": float(lon) if lon is not None else "",
+            "click_lat": lat if lat is not None else "",
+            "click_lon": lon if lon is not None else "",
             "user_lat": user_lat,
             "user_lon": user_lon
         }
-        with st.spinner("Submitting… please wait a few seconds"):
-            ok, code, preview = send_to_google_form(payload, timeout=20)
-        if ok:
-            st.sidebar.success("✅ Thanks! Your response has been saved.")
-        else:
-            st.sidebar.warning(f"Submission issue (HTTP {code}). Please try again.")
+        # Don't hold the page for the POST; failures show up on the next run
+        submit_in_background(
+            send_to_google_form, form_data(payload), failed_log=FAILED_SUBMITS_LOG,
+            timeout=20, session=get_http_session(),
+        )
+        st.toast("Thanks! Your response is being saved. If it can’t be sent, a note will appear in the sidebar.", icon="✅")
+
+with st.sidebar:
+    st.header("Rate this street")
+    rate_street(selected, lat, lon, user_lat, user_lon)
@@ -1,17 +1,14 @@
 import os
-import json
-import gzip
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import partial
 
-import numpy as np
-import pandas as pd
-import geopandas as gpd
 import streamlit as st
-import folium
-from shapely.geometry import Point, mapping
 from streamlit_folium import st_folium
-from branca.colormap import LinearColormap
-import requests  # Google Form'a POST için
+from survey_core import (
+    cell_text, get_geojson_data, get_http_session, get_tree, load_data, make_map,
+    nearest_index, show_submit_outcomes, start_submit_retry, submit_form,
+    submit_in_background,
+)
 
 # (Optional) get user geolocation; if missing, we fall back to blanks
 try:
@@ -20,6 +17,9 @@ try:
 except Exception:
     HAS_JS_GEO = False
 
+# Show the submitted response as JSON under the form (APP_DEBUG=1 only)
+DEBUG = os.getenv("APP_DEBUG") == "1"
+
 # =========================
 #  Google Form settings
 # =========================
@@ -46,12 +46,12 @@ ENTRY_MAP = {
 }
 
 
-def send_to_google_form(response: dict, timeout: int = 20):
+def form_data(response: dict) -> dict:
     """
-    Streamlit'te topladığımız response dict'ini Google Form'a POST eder.
-    200 veya 302 dönerse 'başarılı' kabul ediyoruz.
+    Streamlit'te topladığımız response dict'ini Google Form alanlarına
+    (entry id -> str) çevirir; POST edilen (ve gerekirse bekletilen) sadece bu.
     """
-    data = {
+    return {
         ENTRY_MAP["osmid"]:             str(response.get("osmid", "")),
         ENTRY_MAP["highway"]:           str(response.get("highway", "")),
         ENTRY_MAP["pred_label"]:        str(response.get("pred_label", "")),
@@ -67,8 +67,9 @@ def send_to_google_form(response: dict, timeout: int = 20):
         ENTRY_MAP["noise_sensitivity"]: str(response.get("noise_sensitivity_1to5", "")),
     }
 
-    r = requests.post(FORM_URL, data=data, timeout=timeout)
-    return r.status_code in (200, 302), r.status_code, r.text[:200]
+
+# POSTed through the shared session; see survey_core.submit_form
+send_to_google_form = partial(submit_form, FORM_URL)
 
 
 # =========================
@@ -100,130 +101,9 @@ how well our noise predictions match what people actually feel on the ground.
 - There is no right or wrong answer – we are interested in **your perception**.
 """)
 
-# =========================
-#  Data loader (.geojson / .geojson.gz)
-#  + geometry cleaning (cached)
-# =========================
-@st.cache_data
-def load_data(path: str) -> gpd.GeoDataFrame:
-    """Load and clean the roads GeoDataFrame (runs once, then cached)."""
-    if not os.path.exists(path):
-        try:
-            listing = os.listdir("data")
-        except Exception:
-            listing = []
-        st.error(
-            f"Data file not found: {path}\n\n"
-            f"Available in ./data: {listing}\n"
-            f"Tip: put your file under ./data and update DF_PATH."
-        )
-        st.stop()
-
-    # LFS pointer check
-    try:
-        with open(path, "rb") as f:
-            head = f.read(64)
-        if head.startswith(b"version https://git-lfs.github.com/spec"):
-            st.error(
-                "⚠️ The file seems to be a Git LFS pointer, not the actual GeoJSON.\n\n"
-                "Fix: commit a simplified GeoJSON or gzipped GeoJSON under 25MB."
-            )
-            st.stop()
-    except Exception:
-        pass
-
-    # Read file WITHOUT using geopandas.read_file/fiona
-    try:
-        if path.endswith(".geojson.gz"):
-            with gzip.open(path, "rt", encoding="utf-8") as f:
-                data = json.load(f)
-        else:
-            with open(path, "rt", encoding="utf-8") as f:
-                data = json.load(f)
-
-        if isinstance(data, dict) and "features" in data:
-            gdf = gpd.GeoDataFrame.from_features(data["features"])
-        else:
-            st.error("❌ File is not a valid GeoJSON FeatureCollection.")
-            st.stop()
-
-        if gdf.crs is None:
-            gdf.set_crs(4326, inplace=True)
-        else:
-            gdf = gdf.to_crs(4326)
-
-    except Exception as e:
-        st.error(f"❌ Failed to read geo data as GeoJSON: {path}\n\n{e}")
-        st.stop()
-
-    # Geometry cleaning
-    gdf = gdf[gdf.geometry.notna()].copy()
-    if hasattr(gdf.geometry, "is_empty"):
-        gdf = gdf[~gdf.geometry.is_empty].copy()
-    gdf = gdf[gdf.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
-    gdf = gdf.explode(index_parts=False, ignore_index=True)
-
-    # Disturbance numeric + label
-    gdf["disturbance"] = pd.to_numeric(gdf.get("disturbance"), errors="coerce").fillna(0.0).clip(0, 1)
-    if "disturbance_label" not in gdf.columns:
-        bins = [0, 0.33, 0.66, 1]
-        gdf["disturbance_label"] = pd.cut(
-            gdf["disturbance"], bins=bins,
-            labels=["Low", "Medium", "High"],
-            include_lowest=True
-        )
-
-    if len(gdf) == 0:
-        st.error("No line features to display after cleaning. Check your input data.")
-        st.stop()
-
-    return gdf
-
-
-def to_py(obj):
-    if isinstance(obj, np.generic):
-        obj = obj.item()
-    if isinstance(obj, (pd.Timestamp, datetime)):
-        return obj.isoformat()
-    try:
-        if pd.isna(obj):
-            return None
-    except Exception:
-        pass
-    if hasattr(obj, "tolist") and not isinstance(obj, (str, bytes)):
-        try:
-            return obj.tolist()
-        except Exception:
-            pass
-    return obj
-
-
-@st.cache_data
-def get_geojson_data(path: str) -> dict:
-    """Build GeoJSON dict for Folium from the cached GeoDataFrame."""
-    gdf = load_data(path)
-    props_cols = [c for c in gdf.columns if c != gdf.geometry.name]
-    features = []
-    for _, row in gdf.iterrows():
-        geom = row.geometry
-        if geom is None:
-            continue
-        features.append({
-            "type": "Feature",
-            "geometry": mapping(geom),
-            "properties": {col: to_py(row[col]) for col in props_cols}
-        })
-    return {"type": "FeatureCollection", "features": features}
-
-
-@st.cache_resource
-def get_sindex(_gdf: gpd.GeoDataFrame):
-    """Create a spatial index for fast nearest-segment queries."""
-    try:
-        return _gdf.sindex
-    except Exception:
-        return None
-
+# Responses whose POST failed wait here until the retry thread gets them through
+FAILED_SUBMITS_LOG = "feedback/failed_submits_app_survey_3.jsonl"
+start_submit_retry(FAILED_SUBMITS_LOG, partial(send_to_google_form, timeout=20, session=get_http_session()))
 
 # =========================
 #  Load data (cached)
@@ -232,29 +112,12 @@ DF_PATH = "data/roads_wgs_fribourg_bbox.geojson"  # küçük bbox dosyan
 
 df = load_data(DF_PATH)
 geojson_data = get_geojson_data(DF_PATH)
-sindex = get_sindex(df)
+get_tree(DF_PATH, df)  # build the index with the data, not on the first click
 
 # =========================
 # Map (no legend, no tooltip)
 # =========================
-center = [
-    df.geometry.representative_point().y.mean(),
-    df.geometry.representative_point().x.mean()
-]
-m = folium.Map(location=center, zoom_start=14, tiles="cartodbpositron")
-
-cmap = LinearColormap(['green', 'yellow', 'orange', 'red'], vmin=0, vmax=1)
-
-folium.GeoJson(
-    geojson_data,
-    style_function=lambda f: {
-        "color": cmap(float(f["properties"].get("disturbance", 0))),
-        "weight": 3 if float(f["properties"].get("disturbance", 0)) < 0.7 else 4,
-        "opacity": 0.9 if float(f["properties"].get("disturbance", 0)) >= 0.33 else 0.6
-    },
-    highlight_function=lambda f: {"weight": 6},
-    name="Roads"
-).add_to(m)
+m = make_map(DF_PATH, geojson_data, df.total_bounds, zoom_start=14)
 
 st.caption(
     "Click a street line on the map, then use the sidebar to answer the questions "
@@ -276,26 +139,7 @@ lat = lon = None
 if out and out.get("last_object_clicked"):
     lat = float(out["last_object_clicked"]["lat"])
     lon = float(out["last_object_clicked"]["lng"])
-    click_geom = Point(lon, lat)  # df already in 4326
-
-    if sindex is not None:
-        try:
-            nearest_idx = sindex.nearest(click_geom, return_all=False)
-            tree_idx = None
-            if hasattr(nearest_idx, "shape") and nearest_idx.shape[0] == 2:
-                tree_idx = int(nearest_idx[1][0])
-            else:
-                idx_list = list(nearest_idx)
-                tree_idx = int(idx_list[0])
-            selected = df.iloc[tree_idx]
-        except Exception:
-            distances = df.distance(click_geom)
-            idx = distances.sort_values().index[0]
-            selected = df.loc[idx]
-    else:
-        distances = df.distance(click_geom)
-        idx = distances.sort_values().index[0]
-        selected = df.loc[idx]
+    selected = df.iloc[nearest_index(DF_PATH, df, lon, lat)]
 
 user_lat = user_lon = ""
 if HAS_JS_GEO:
@@ -310,6 +154,38 @@ if HAS_JS_GEO:
 # =========================
 # Sidebar: Demographics + Noise sensitivity + Street rating
 # =========================
+GENDER_OPTIONS = (
+    "Prefer not to say",
+    "Female",
+    "Male",
+    "Non-binary / Other",
+)
+
+YEARS_FRIBOURG_OPTIONS = (
+    "I don’t live in Fribourg",
+    "Less than 1 year",
+    "1–3 years",
+    "3–5 years",
+    "More than 5 years",
+)
+
+ROLE_OPTIONS = (
+    "Local resident",
+    "Student",
+    "Commuter (I work here but live elsewhere)",
+    "Tourist / visitor",
+    "Other",
+)
+
+NOISE_SENSITIVITY_HELP = (
+    "People differ a lot in how quickly they feel annoyed or stressed by "
+    "noise (traffic, crowds, construction, etc.). "
+    "Please rate your own sensitivity in daily life, compared to an "
+    "average person of your age.\n\n"
+    "1 = very low (I rarely get bothered by noise)\n"
+    "5 = very high (noise bothers me very easily)."
+)
+
 st.sidebar.header("About you")
 
 name = st.sidebar.text_input("Name and surname *", key="name")
@@ -324,38 +200,21 @@ age = st.sidebar.number_input(
 
 gender = st.sidebar.selectbox(
     "What is your gender?",
-    options=[
-        "Prefer not to say",
-        "Female",
-        "Male",
-        "Non-binary / Other",
-    ],
+    options=GENDER_OPTIONS,
     index=0,
     key="gender",
 )
 
 years_fribourg = st.sidebar.selectbox(
     "How long have you been living in Fribourg? *",
-    options=[
-        "I don’t live in Fribourg",
-        "Less than 1 year",
-        "1–3 years",
-        "3–5 years",
-        "More than 5 years",
-    ],
+    options=YEARS_FRIBOURG_OPTIONS,
     index=0,
     key="years_fribourg",
 )
 
 role = st.sidebar.selectbox(
     "Which of the following best describes you? *",
-    options=[
-        "Local resident",
-        "Student",
-        "Commuter (I work here but live elsewhere)",
-        "Tourist / visitor",
-        "Other",
-    ],
+    options=ROLE_OPTIONS,
     index=1,
     key="role",
 )
@@ -365,94 +224,108 @@ noise_sensitivity = st.sidebar.slider(
     min_value=1,
     max_value=5,
     value=3,
-    help=(
-        "People differ a lot in how quickly they feel annoyed or stressed by "
-        "noise (traffic, crowds, construction, etc.). "
-        "Please rate your own sensitivity in daily life, compared to an "
-        "average person of your age.\n\n"
-        "1 = very low (I rarely get bothered by noise)\n"
-        "5 = very high (noise bothers me very easily)."
-    ),
+    help=NOISE_SENSITIVITY_HELP,
     key="noise_sensitivity_1to5",
 )
 
 st.sidebar.markdown("---")
-st.sidebar.header("Rate this street")
 
-if selected is None:
-    st.sidebar.info("Click a street on the map to start rating.")
-else:
-    pred_label = str(selected.get('disturbance_label', ''))
+# Demographics as one dict, so the rating fragment gets them as an argument
+about = {
+    "name": name.strip(),
+    "age": int(age),
+    "gender": gender,
+    "years_fribourg": years_fribourg,
+    "role": role,
+    "noise_sensitivity_1to5": int(noise_sensitivity),
+}
+
+
+@st.fragment
+def rate_street(selected, lat, lon, user_lat, user_lon, about):
+    """Rating form for the clicked street.
+
+    A submit reruns only this fragment, not the map; any change to the map
+    click or to the answers above reruns the page and passes fresh arguments.
+    """
+    # Outcome of earlier submits, which run in the background
+    show_submit_outcomes()
+
+    if selected is None:
+        st.info("Click a street on the map to start rating.")
+        return
+
+    pred_label = cell_text(selected.get('disturbance_label'))
     pred_score = float(selected.get('disturbance', 0.0))
-    highway = str(selected.get('highway', ''))
+    highway = cell_text(selected.get('highway'))
 
-    st.sidebar.write(
+    st.write(
         f"**Selected street:** `{highway}`  \n"
         f"**Model prediction:** {pred_label} "
         f"({pred_score:.2f} on [0, 1])"
     )
 
-    rating = st.sidebar.slider(
-        "How much do you agree with this street’s noise prediction? "
-        "(1 = don’t agree at all, 5 = completely agree) *",
-        1,
-        5,
-        3,
-        key="rating_1to5",
-    )
+    # One form: moving the slider or typing a comment doesn't rerun the
+    # whole page (map included); values arrive together on submit. Not
+    # cleared on submit, so a failed name check doesn't lose the rating.
+    with st.form("rate_street"):
+        rating = st.slider(
+            "How much do you agree with this street’s noise prediction? "
+            "(1 = don’t agree at all, 5 = completely agree) *",
+            1,
+            5,
+            3,
+            key="rating_1to5",
+        )
 
-    if rating <= 2:
-        st.sidebar.warning(
-            "You seem to disagree. Please tell us why, and which color you think "
+        # Inside a form the note can't react to the slider, so it's always shown
+        st.caption(
+            "If you disagree (1–2), please tell us why, and which color you think "
             "this street should be (green / yellow / red)."
         )
 
-    comment = st.sidebar.text_input(
-        "Optional comment (e.g., road works, rush hour, local context)",
-        key="comment",
-    )
+        comment = st.text_input(
+            "Optional comment (e.g., road works, rush hour, local context)",
+            key="comment",
+        )
 
-    submit = st.sidebar.button("Submit response", use_container_width=True)
+        submit = st.form_submit_button("Submit response", use_container_width=True)
 
     if submit:
         errors = []
-        if not name.strip():
+        if not about["name"]:
             errors.append("Please enter your name and surname.")
-        if selected is None:
-            errors.append("Please click a street on the map.")
 
         if errors:
-            st.sidebar.error("Please fix the following:\n- " + "\n- ".join(errors))
+            st.error("Please fix the following:\n- " + "\n- ".join(errors))
         else:
             response = {
-                "timestamp": datetime.utcnow().isoformat(),
-                "name": name.strip(),
-                "age": int(age),
-                "gender": gender,
-                "years_fribourg": years_fribourg,
-                "role": role,
-                "noise_sensitivity_1to5": int(noise_sensitivity),
-                "osmid": str(selected.get("osmid", "")),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                **about,
+                "osmid": cell_text(selected.get("osmid")),
                 "highway": highway,
                 "pred_label": pred_label,
                 "pred_score": pred_score,
                 "rating_1to5": int(rating),
                 "comment": comment,
-                "click_lat": float(lat) if lat is not None else "",
-                "click_lon": float(lon) if lon is not None else "",
+                "click_lat": lat if lat is not None else "",
+                "click_lon": lon if lon is not None else "",
                 "user_lat": user_lat,
                 "user_lon": user_lon,
             }
 
-            ok, code, preview = send_to_google_form(response, timeout=20)
+            # Don't hold the page for the POST; failures show up on the next run
+            submit_in_background(
+                send_to_google_form, form_data(response), failed_log=FAILED_SUBMITS_LOG,
+                timeout=20, session=get_http_session(),
+            )
+            st.toast("Thank you! Your response is being submitted. If it can’t be sent, a note will appear in the sidebar.", icon="✅")
+
+            if DEBUG:
+                with st.expander("Current response (for debugging)"):
+                    st.json(response)
 
-            if ok:
-                st.sidebar.success("✅ Thank you! Your response has been submitted.")
-            else:
-                st.sidebar.warning(
-                    f"Your response could not be sent (HTTP {code}). "
-                    "You can try again later."
-                )
 
-            st.subheader("Current response (for debugging)")
-            st.json(response)
+with st.sidebar:
+    st.header("Rate this street")
+    rate_street(selected, lat, lon, user_lat, user_lon, about)
@@ -0,0 +1,624 @@
+import os
+import re
+import json
+import time
+import random
+import logging
+import threading
+import gzip
+import glob
+import hashlib
+import requests
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import streamlit as st
+import folium
+from shapely.geometry import Point, mapping
+from shapely.strtree import STRtree
+from folium.utilities import JsCode
+from requests.adapters import HTTPAdapter
+from pyproj import Transformer
+from branca.colormap import LinearColormap
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# (Optional) orjson for reading/writing the large GeoJSON; stdlib json otherwise
+try:
+    import orjson
+    HAS_ORJSON = True
+except Exception:
+    HAS_ORJSON = False
+
+# =========================
+# Google Form HTTP session + background submits
+# =========================
+# No spinner: a spinner is an element, and on older Streamlit nothing may be
+# drawn before st.set_page_config
+@st.cache_resource(show_spinner=False)
+def get_http_session() -> requests.Session:
+    """One pooled keep-alive session per process, so submits skip the TLS handshake."""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return session
+
+def submit_form(form_url: str, data: dict, timeout: int = 20, session=None) -> tuple:
+    """POST form fields (entry id -> str) to a Google Form.
+
+    Returns (ok, status code, start of the body); 200 or 302 considered success.
+    """
+    r = (session or get_http_session()).post(form_url, data=data, timeout=timeout)
+    return r.status_code in (200, 302), r.status_code, r.text[:200]
+
+@st.cache_resource
+def get_submit_executor() -> ThreadPoolExecutor:
+    """Worker threads for form POSTs, shared by all sessions of the process."""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="form-post")
+
+def _try_send(send, payload: dict, kwargs: dict) -> tuple:
+    """(ok, retry, detail) for one send(payload, **kwargs), never raising.
+
+    Only connection errors, 429 and 5xx are worth retrying; anything else
+    (e.g. a 4xx after the form's entry ids changed) fails the same way again.
+    A read timeout is a failure that isn't retried either: the form got the
+    request and may have recorded it, and the POST isn't idempotent.
+    """
+    try:
+        ok, code, _ = send(payload, **kwargs)
+    except requests.exceptions.ReadTimeout:
+        return False, False, "no reply in time, it may not have been recorded"
+    except requests.exceptions.ConnectionError as e:
+        return False, True, type(e).__name__
+    except Exception as e:
+        return False, False, type(e).__name__
+    return ok, not ok and (code == 429 or code >= 500), f"HTTP {code}"
+
+def _post_or_park(send, payload: dict, failed_log, kwargs: dict) -> tuple:
+    """Worker body: (ok, detail, queued) for send(payload, **kwargs).
+
+    A retryable failure is appended to failed_log for the retry thread.
+    """
+    ok, retry, detail = _try_send(send, payload, kwargs)
+    if retry and failed_log is not None:
+        park_failed_submit(failed_log, payload)
+        return False, detail, True
+    return ok, detail, False
+
+def submit_in_background(send, payload: dict, failed_log: str = None, **kwargs) -> None:
+    """Run send(payload, **kwargs) (returning (ok, code, preview)) off the script
+    thread; the outcome is picked up later with pop_finished_submits().
+
+    Resolve cached resources (e.g. the HTTP session) into kwargs here:
+    Streamlit caches belong on the script thread, not the worker.
+    """
+    future = get_submit_executor().submit(_post_or_park, send, payload, failed_log, kwargs)
+    st.session_state.setdefault("pending_submits", []).append(future)
+
+def pop_finished_submits() -> list:
+    """(ok, detail, queued) for each of this session's submits that finished
+    since the last call; detail is "HTTP <code>" or what went wrong, queued
+    means it was parked for an automatic retry."""
+    finished, pending = [], []
+    for future in st.session_state.get("pending_submits", []):
+        (finished if future.done() else pending).append(future)
+    st.session_state["pending_submits"] = pending
+    return [future.result() for future in finished]
+
+def show_submit_outcomes() -> None:
+    """Warn about this session's background submits that failed since the last run.
+
+    Each failure gets a toast, like the submit confirmation, and a warning
+    that stays in place (a toast is gone after a few seconds).
+    """
+    for ok, detail, queued in pop_finished_submits():
+        if queued:
+            msg = f"An earlier response could not be sent yet ({detail}); it will be retried automatically."
+        elif not ok:
+            msg = f"An earlier response could not be sent ({detail}). Please submit it again."
+        else:
+            continue
+        st.toast(msg, icon="⚠️")
+        st.warning(msg)
+
+# =========================
+# Failed submits (append-only log + retry thread)
+# =========================
+# Backoff between retry passes, in seconds: doubles per failing pass, with jitter
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 30 * 60
+
+_failed_log_lock = threading.Lock()
+
+def _append_lines(path: str, lines: list) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(line + "\n" for line in lines)
+
+def park_failed_submit(path: str, payload: dict) -> None:
+    """Append payload to the JSON-lines log at path.
+
+    Pass only what is posted (the form fields), since it sits on disk until
+    the retry thread gets it through; the log is removed once empty.
+    """
+    with _failed_log_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        _append_lines(path, [json.dumps(payload, ensure_ascii=False)])
+
+def _read_lines(path: str) -> list:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def _retry_pass(path: str, send) -> bool:
+    """Re-send everything parked in path once; True if some of it still fails.
+
+    Lines that don't parse (e.g. cut short when the process was killed) are
+    moved to <path>.bad instead of stopping the thread. Responses the form now
+    rejects for good (see _try_send) are moved to <path>.dead: they can't hold
+    the backoff at its maximum for everything parked after them, and the log
+    may be the only copy of the answer.
+    """
+    with _failed_log_lock:
+        lines = _read_lines(path)
+    if not lines:
+        return False
+
+    bad, dead, still_failed = [], [], []
+    for line in lines:
+        try:
+            payload = json.loads(line)
+        except ValueError:
+            bad.append(line)
+            continue
+        ok, retry, detail = _try_send(send, payload, {})
+        if retry:
+            still_failed.append(line)
+        elif not ok:
+            logger.warning("Parked response failed for good (%s); moved to %s.dead", detail, path)
+            dead.append(line)
+
+    with _failed_log_lock:
+        if bad:
+            logger.warning("Moved %d unreadable line(s) from %s to %s.bad", len(bad), path, path)
+            _append_lines(path + ".bad", bad)
+        if dead:
+            _append_lines(path + ".dead", dead)
+        # Keep whatever was parked while this pass was sending
+        rest = still_failed + _read_lines(path)[len(lines):]
+        if not rest:
+            os.remove(path)  # nothing of a response stays on disk once it's sent
+        else:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(line + "\n" for line in rest)
+            os.replace(tmp_path, path)
+    return bool(still_failed)
+
+def _retry_parked(path: str, send) -> None:
+    failing_passes = 0
+    while True:
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** failing_passes)
+        time.sleep(delay * (0.5 + random.random() / 2))
+        # Never let one bad pass end the thread: start_submit_retry is cached,
+        # so a dead thread would stay dead for the life of the process
+        try:
+            failing = _retry_pass(path, send)
+        except Exception:
+            logger.exception("Retry pass over %s failed", path)
+            failing = True
+        failing_passes = failing_passes + 1 if failing else 0
+
+@st.cache_resource(show_spinner=False)
+def start_submit_retry(path: str, _send) -> threading.Thread:
+    """Daemon thread re-sending the payloads parked in path, once per process.
+
+    _send takes a payload and returns (ok, code, preview); it is prefixed with
+    underscore so Streamlit doesn't try to hash it.
+    """
+    thread = threading.Thread(target=_retry_parked, args=(path, _send), name="form-retry", daemon=True)
+    thread.start()
+    return thread
+
+# =========================
+# Roads data (.geojson / .geojson.gz)
+# + geometry cleaning (cached)
+# =========================
+DISTURBANCE_BINS = [0.33, 0.66]
+DISTURBANCE_LABELS = ["Low", "Medium", "High"]
+
+def disturbance_labels(values) -> pd.Categorical:
+    """Low/Medium/High for each score, same bins as pd.cut on [0, .33, .66, 1].
+
+    Bins are right-closed with 0 included; NaN or out-of-range scores are missing.
+    Returned as a Categorical (int8 codes) rather than one string per row.
+    """
+    vals = np.asarray(values, dtype=float)
+    # Two comparisons instead of a search: ">" keeps the bins right-closed
+    codes = (vals > DISTURBANCE_BINS[0]).astype(np.int8) + (vals > DISTURBANCE_BINS[1])
+    codes[np.isnan(vals) | (vals < 0) | (vals > 1)] = -1
+    return pd.Categorical.from_codes(codes, categories=DISTURBANCE_LABELS, ordered=True)
+
+def _loads_geojson(raw: bytes):
+    """orjson when available; stdlib json for what orjson rejects (NaN/Infinity
+    tokens, as pandas/geopandas exports can write)."""
+    if HAS_ORJSON:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+# Bump whenever load_data stores something different (cleaning, labels,
+# dtypes), so sidecars written by older code are rebuilt instead of trusted.
+# 1: cleaned, exploded line segments (unversioned sidecars held the raw frame)
+# 2: missing text values kept null instead of "nan"/"None"
+SIDECAR_VERSION = 2
+
+def sidecar_path(path: str) -> str:
+    """GeoParquet copy of the GeoJSON at path, for the current SIDECAR_VERSION."""
+    return f"{path.split('.geojson')[0]}.v{SIDECAR_VERSION}.parquet"
+
+# A resource, so reruns share one frame instead of unpickling a copy;
+# nothing downstream mutates it
+@st.cache_resource
+def load_data(path: str) -> gpd.GeoDataFrame:
+    """Load and clean the roads GeoDataFrame (runs once, then cached)."""
+    if not os.path.exists(path):
+        try:
+            listing = os.listdir("data")
+        except Exception:
+            listing = []
+        st.error(
+            f"Data file not found: {path}\n\n"
+            f"Available in ./data: {listing}\n"
+            f"Tip: put your file under ./data and update DF_PATH."
+        )
+        st.stop()
+
+    # Binary sidecar: once the GeoJSON has been parsed, later cold starts
+    # read the GeoParquet copy instead (unless the source is newer). A fresh
+    # sidecar means the source already parsed, so the LFS probe is skipped too
+    parquet_path = sidecar_path(path)
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(path):
+        try:
+            return gpd.read_parquet(parquet_path)
+        except Exception:
+            pass
+
+    # LFS pointer check (new or changed source only)
+    try:
+        with open(path, "rb") as f:
+            head = f.read(64)
+        if head.startswith(b"version https://git-lfs.github.com/spec"):
+            st.error(
+                "⚠️ The file seems to be a Git LFS pointer, not the actual GeoJSON.\n\n"
+                "Fix: commit a simplified GeoJSON or gzipped GeoJSON under 25MB."
+            )
+            st.stop()
+    except Exception:
+        pass
+
+    # Read file WITHOUT using geopandas.read_file/fiona
+    try:
+        if path.endswith(".geojson.gz"):
+            with gzip.open(path, "rb") as f:
+                raw = f.read()
+                data = _loads_geojson(raw)
+        else:
+            with open(path, "rb") as f:
+                raw = f.read()
+                data = _loads_geojson(raw)
+
+        if isinstance(data, dict) and "features" in data:
+            gdf = gpd.GeoDataFrame.from_features(data["features"])
+        else:
+            st.error("❌ File is not a valid GeoJSON FeatureCollection.")
+            st.stop()
+
+        if gdf.crs is None:
+            gdf.set_crs(4326, inplace=True)
+        else:
+            gdf = gdf.to_crs(4326)
+
+    except Exception as e:
+        st.error(f"❌ Failed to read geo data as GeoJSON: {path}\n\n{e}")
+        st.stop()
+
+    # Geometry cleaning
+    # One mask (None has type id -1), then a single explode
+    geoms = gdf.geometry.values
+    is_line = np.isin(shapely.get_type_id(geoms), [shapely.GeometryType.LINESTRING, shapely.GeometryType.MULTILINESTRING])
+    gdf = gdf[is_line & ~shapely.is_empty(geoms)].explode(index_parts=False, ignore_index=True)
+
+    # Disturbance numeric + label
+    gdf["disturbance"] = np.clip(np.nan_to_num(pd.to_numeric(gdf.get("disturbance"), errors="coerce").to_numpy(dtype=float)), 0.0, 1.0)
+    if "disturbance_label" not in gdf.columns:
+        gdf["disturbance_label"] = disturbance_labels(gdf["disturbance"])
+
+    if len(gdf) == 0:
+        st.error("No line features to display after cleaning. Check your input data.")
+        st.stop()
+
+    # osmid mixes single ids and id lists, which Parquet can't store in one
+    # column; keep the text form (that's what the form submission sends anyway).
+    # Missing values (None, or NaN for a property absent from some features)
+    # stay null rather than becoming "None"/"nan"
+    for col in gdf.columns:
+        if gdf[col].dtype == object:
+            gdf[col] = gdf[col].map(lambda v: None if v is None or v != v else str(v))
+    try:
+        gdf.to_parquet(parquet_path, compression="zstd")
+        # Other versions, plus the unversioned <stem>.parquet that held the raw,
+        # uncleaned frame from before cleaning moved in here
+        stem = path.split(".geojson")[0]
+        for stale in glob.glob(stem + ".v*.parquet") + glob.glob(stem + ".parquet"):
+            if stale != parquet_path:
+                os.remove(stale)
+    except Exception:
+        pass  # pyarrow missing or read-only checkout: keep reading GeoJSON
+
+    return gdf
+
+def cell_text(value) -> str:
+    """Text of a row value for the form; "" when it is missing (None/NaN)."""
+    return "" if value is None or value != value else str(value)
+
+# =========================
+# GeoJSON layer
+# =========================
+def geometry_dicts(geoms) -> list:
+    """GeoJSON geometry dicts for an array of shapely geometries.
+
+    LineStrings (every segment after cleaning) take their coordinates from one
+    shapely.get_coordinates call; other types go through mapping(), None stays None.
+    """
+    coords = shapely.get_coordinates(geoms).tolist()
+    ends = np.cumsum(shapely.get_num_coordinates(geoms)).tolist()
+    is_line = (shapely.get_type_id(geoms) == shapely.GeometryType.LINESTRING).tolist()
+    out = []
+    start = 0
+    for geom, end, line in zip(geoms, ends, is_line):
+        if line:
+            out.append({"type": "LineString", "coordinates": coords[start:end]})
+        else:
+            out.append(mapping(geom) if geom is not None else None)
+        start = end
+    return out
+
+def _float_to_py(x):
+    x = float(x)
+    return None if x != x else x
+
+# Exact-type fast paths for the usual cell values; anything else goes
+# through the general conversion in _to_py_slow
+_TO_PY = {
+    str: str,
+    int: int,
+    bool: bool,
+    type(None): lambda x: None,
+    float: _float_to_py,
+    np.float64: _float_to_py,
+    np.float32: _float_to_py,
+    np.int64: int,
+    np.int32: int,
+    np.bool_: bool,
+    np.str_: str,
+}
+
+def to_py(obj):
+    fn = _TO_PY.get(type(obj))
+    return fn(obj) if fn is not None else _to_py_slow(obj)
+
+def _to_py_slow(obj):
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, (pd.Timestamp, datetime)):
+        return obj.isoformat()
+    try:
+        if pd.isna(obj):
+            return None
+    except Exception:
+        pass
+    if hasattr(obj, "tolist") and not isinstance(obj, (str, bytes)):
+        try:
+            return obj.tolist()
+        except Exception:
+            pass
+    return obj
+
+# Properties shipped to the browser: only what the layer uses. The clicked
+# segment is looked up in df, so the form still sees every column.
+LAYER_COLUMNS = ["highway", "disturbance", "disturbance_label"]
+# Douglas-Peucker tolerance for the browser layer, in degrees (~1 m here):
+# below a pixel up to zoom 18. Clicks still resolve on the full geometry.
+LAYER_SIMPLIFY_TOL = 1e-5
+# Coordinate decimals shipped to the browser (1e-5 degrees is ~1 m)
+LAYER_DECIMALS = 5
+
+@st.cache_resource
+def get_cmap() -> LinearColormap:
+    """Disturbance colormap (0 = green, 1 = red), built once per process."""
+    return LinearColormap(['green', 'yellow', 'orange', 'red'], vmin=0, vmax=1)
+
+def colormap_hex(cmap: LinearColormap, values) -> list:
+    """Vectorized equivalent of ``[cmap(v) for v in values]``."""
+    stops = np.asarray(cmap.colors, dtype=float)
+    vals = np.asarray(values, dtype=float)
+    rgba = np.column_stack([np.interp(vals, cmap.index, stops[:, j]) for j in range(4)])
+    rgba = (rgba * 255.9999).astype(np.uint8)
+    # Only a handful of distinct colors: format each once, then broadcast
+    uniq, inverse = np.unique(rgba, axis=0, return_inverse=True)
+    hexes = np.array(["#%02x%02x%02x%02x" % tuple(c) for c in uniq])
+    return hexes[inverse.ravel()].tolist()
+
+def build_geojson(gdf: gpd.GeoDataFrame) -> dict:
+    """FeatureCollection dict for gdf; rows with a missing geometry are skipped."""
+    # Convert each column to plain Python once: numeric columns in C via
+    # tolist(), to_py only where values can be arbitrary objects
+    cols = [c for c in gdf.columns if c != gdf.geometry.name]
+    col_lists = []
+    for col in cols:
+        s = gdf[col]
+        if pd.api.types.is_numeric_dtype(s):
+            col_lists.append(s.to_numpy(dtype=object, na_value=None).tolist())
+        elif isinstance(s.dtype, pd.CategoricalDtype):
+            # Convert each category once, then index by code (-1 is missing)
+            cats = [to_py(c) for c in s.cat.categories] + [None]
+            col_lists.append([cats[c] for c in s.cat.codes.tolist()])
+        elif pd.api.types.is_datetime64_any_dtype(s):
+            col_lists.append(s.dt.strftime("%Y-%m-%dT%H:%M:%S").where(s.notna(), None).tolist())
+        else:
+            col_lists.append([to_py(v) for v in s])
+    props = [dict(zip(cols, row)) for row in zip(*col_lists)]
+
+    features = [
+        {"type": "Feature", "geometry": geom, "properties": p}
+        for geom, p in zip(geometry_dicts(gdf.geometry.values), props)
+        if geom is not None
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+@st.cache_resource(show_spinner=False)
+def get_geojson_data(path: str) -> dict:
+    """Build the browser layer for path from the cached GeoDataFrame.
+
+    Cached as a resource so reruns reuse the same dict instead of unpickling a
+    copy; treat it as read-only.
+    """
+    gdf = load_data(path)
+    keep = [c for c in LAYER_COLUMNS if c in gdf.columns] + [gdf.geometry.name]
+    gdf = gdf[keep].assign(_color=colormap_hex(get_cmap(), gdf["disturbance"]))
+    gdf = gdf.set_geometry(gdf.geometry.simplify(LAYER_SIMPLIFY_TOL, preserve_topology=False))
+    gdf = gdf.set_geometry(shapely.transform(gdf.geometry.values, lambda xy: xy.round(LAYER_DECIMALS)))
+    return build_geojson(gdf)
+
+# =========================
+# Spatial index (nearest search)
+# =========================
+@st.cache_resource
+def get_tree(path: str, _gdf) -> tuple:
+    """STRtree over the segments of path in a local metric CRS, plus the
+    lon/lat -> metric transformer for click points.
+
+    Distances in degrees are skewed (at Fribourg a degree of longitude is ~0.68
+    of a degree of latitude), so the segments are projected to UTM once here.
+    _gdf is prefixed with underscore so Streamlit doesn't try to hash it.
+    """
+    metric_crs = _gdf.estimate_utm_crs()
+    to_metric = Transformer.from_crs(_gdf.crs, metric_crs, always_xy=True)
+    return STRtree(_gdf.to_crs(metric_crs).geometry.values), to_metric
+
+def nearest_index(path: str, gdf, lon: float, lat: float) -> int:
+    """Positional index in gdf of the segment nearest to (lon, lat), in metres."""
+    tree, to_metric = get_tree(path, gdf)
+    pt = Point(*to_metric.transform(lon, lat))
+    try:
+        return int(tree.nearest(pt))
+    except Exception:
+        # Brute-force fallback over the same projected geometries
+        return int(np.argmin(shapely.distance(tree.geometries, pt)))
+
+# =========================
+# Static roads layer
+# =========================
+STATIC_DIR = "static"  # served at /app/static/ (server.enableStaticServing)
+
+@st.cache_resource(show_spinner=False)
+def publish_geojson(path: str, _geojson: dict) -> str:
+    """Write the roads layer under ./static once per layer version, return its URL.
+
+    Older versions of the same layer are deleted once the new file is in place.
+
+    _geojson is prefixed with underscore so Streamlit doesn't try to hash it.
+    """
+    if HAS_ORJSON:
+        payload = orjson.dumps(_geojson, option=orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        # Same compact UTF-8 output as orjson
+        payload = json.dumps(_geojson, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    stem = os.path.basename(path).split(".")[0]
+    name = f"{stem}_{hashlib.md5(payload).hexdigest()[:10]}.geojson"
+    out_path = os.path.join(STATIC_DIR, name)
+    if not os.path.exists(out_path):
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, out_path)
+        # Drop this layer's earlier versions (exact stem: "roads_wgs_*" would
+        # also match the fribourg_bbox layer)
+        stale = re.compile(re.escape(stem) + r"_[0-9a-f]{10}\.geojson")
+        for old_name in os.listdir(STATIC_DIR):
+            if old_name != name and stale.fullmatch(old_name):
+                os.remove(os.path.join(STATIC_DIR, old_name))
+    base = st.get_option("server.baseUrlPath").strip("/")
+    return f"/{base}/app/static/{name}" if base else f"/app/static/{name}"
+
+# =========================
+# Map (no legend, no tooltip)
+# =========================
+# Road style evaluated in the browser from the baked-in _color/disturbance
+# properties, so folium doesn't call a Python style_function per feature
+# (and inline one switch case per segment) on every rerun.
+ROAD_STYLE_JS = """function(feature) {
+    var d = feature.properties.disturbance || 0;
+    return {
+        color: feature.properties._color,
+        weight: d < 0.7 ? 3 : 4,
+        opacity: d >= 0.33 ? 0.9 : 0.6
+    };
+}"""
+
+# Thicken a segment on hover, restore its own style on mouseout
+ROAD_HIGHLIGHT_JS = """function(feature, layer) {
+    layer.on({
+        mouseover: function(e) { e.target.setStyle({weight: 6}); },
+        mouseout: function(e) { e.target.setStyle((%s)(e.target.feature)); }
+    });
+}""" % ROAD_STYLE_JS
+
+class RoadsLayer(folium.GeoJson):
+    """GeoJson layer that reports the dataset's known bounds.
+
+    st_folium calls Map.get_bounds() on every rerun; the stock GeoJson walks
+    every coordinate of the layer for that, which dominated reruns triggered
+    by unrelated widgets (slider, comment box).
+    """
+    def __init__(self, data, bounds, **kwargs):
+        super().__init__(data, **kwargs)
+        minx, miny, maxx, maxy = (float(v) for v in bounds)
+        self._bounds = [[miny, minx], [maxy, maxx]]
+
+    def _get_self_bounds(self):
+        return self._bounds
+
+def make_map(path: str, geojson_data: dict, bounds, zoom_start: int = 13) -> folium.Map:
+    """Build the survey map: light basemap centered on bounds plus the roads layer.
+
+    Not cached: st_folium renders and renames the Map it is given, so every
+    rerun needs its own instance. The layer data and its static file are cached.
+    """
+    minx, miny, maxx, maxy = bounds
+    center = [(miny + maxy) / 2, (minx + maxx) / 2]
+    # Canvas renderer: one <canvas> for all segments instead of an SVG path each
+    m = folium.Map(location=center, zoom_start=zoom_start, tiles="cartodbpositron", prefer_canvas=True)
+
+    roads = RoadsLayer(
+        geojson_data,
+        bounds,
+        style=JsCode(ROAD_STYLE_JS),
+        on_each_feature=JsCode(ROAD_HIGHLIGHT_JS),
+        # No tooltip to avoid technical fields
+        name="Roads"
+    )
+    if st.get_option("server.enableStaticServing"):
+        # Let the browser fetch the layer (gzipped in transit by the server)
+        # instead of inlining every feature into the map HTML on each rerun
+        roads.embed = False
+        roads.embed_link = publish_geojson(path, geojson_data)
+    roads.add_to(m)
+    return m